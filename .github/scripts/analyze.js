@@ -18,7 +18,7 @@
 import fs from 'fs';
 import path from 'path';
 import process from 'process';
-import { Octokit } from '@octokit/rest';
+import { StringDecoder } from 'string_decoder';
 
 const OPENAI_KEY = process.env.OPENAI_API_KEY;
 const GITHUB_TOKEN = process.env.GITHUB_TOKEN;
@@ -38,20 +38,135 @@ if (!REPO) {
   process.exit(1);
 }
 
+// Each diff chunk costs one OpenAI call; MAX_CHUNKS bounds the calls per run
+const CHUNK_CHARS = 15000;
+const MAX_CHUNKS = 40;
+
+// Split a unified diff into per-file sections, each starting at its "diff --git" line
+function splitDiffSections(text) {
+  return text.split(/^(?=diff --git )/m);
+}
+
+function sectionPath(section) {
+  const m = section.match(/^diff --git a\/\S+ b\/(\S+)/);
+  return m ? m[1] : section.slice(0, section.indexOf('\n'));
+}
+
+// Vendored, minified and binary-asset paths carry no reviewable source
+const SKIPPED_PATH = /(^|\/)(node_modules|vendor|dist)\/|\.min\.(js|css)$|\.(png|jpe?g|gif|ico|pdf|zip|jar|class|woff2?|mp4)$/i;
+const BINARY_SECTION = /^(Binary files |GIT binary patch)/m;
+
+function isAnalyzableSection(section) {
+  return !SKIPPED_PATH.test(sectionPath(section)) && !BINARY_SECTION.test(section);
+}
+
+// Upper bound on analyzable diff text collected; each character fills part of a chunk, so nothing past this could be sent
+const MAX_ANALYZED_CHARS = MAX_CHUNKS * CHUNK_CHARS;
+const READ_BLOCK_BYTES = 1024 * 1024;
+
+// Read a diff a block at a time, keeping only analyzable per-file sections and one copy of sections whose hunks are
+// identical (generated or copied files) with the other paths noted on it. Skipped and duplicate sections never
+// count toward maxChars; reading stops at the first new analyzable section once maxChars has been collected.
+function readAnalyzableSections(file, maxChars) {
+  const groups = new Map();
+  let collected = 0;
+  let sawDiff = false;
+
+  const take = (section) => {
+    if (section.trim().length === 0) return true;
+    sawDiff = true;
+    if (!isAnalyzableSection(section)) return true;
+    const hunks = section.indexOf('\n@@');
+    const key = hunks === -1 ? section : section.slice(hunks);
+    const group = groups.get(key);
+    if (group) {
+      group.others.push(sectionPath(section));
+      return true;
+    }
+    if (collected >= maxChars) return false;
+    groups.set(key, { section, others: [] });
+    collected += section.length;
+    return true;
+  };
+
+  let truncated = false;
+  if (fs.existsSync(file)) {
+    const fd = fs.openSync(file, 'r');
+    try {
+      // StringDecoder holds back a partial codepoint at a block edge; the last section stays pending until EOF
+      const decoder = new StringDecoder('utf8');
+      const buf = Buffer.allocUnsafe(READ_BLOCK_BYTES);
+      let pending = '';
+      for (let eof = false; !eof && !truncated;) {
+        const n = fs.readSync(fd, buf, 0, buf.length, null);
+        eof = n === 0;
+        const sections = splitDiffSections(pending + (eof ? decoder.end() : decoder.write(buf.subarray(0, n))));
+        pending = eof ? '' : sections.pop();
+        truncated = !sections.every(take);
+      }
+    } finally {
+      fs.closeSync(fd);
+    }
+  }
+
+  const sections = [];
+  for (const { section, others } of groups.values()) {
+    sections.push(others.length > 0 ? `# Identical changes also in: ${others.join(', ')}\n${section}` : section);
+  }
+  return { sections, truncated, sawDiff };
+}
+
 const diffPath = path.resolve('.github/scripts/pr.diff');
-const raw = fs.existsSync(diffPath) ? fs.readFileSync(diffPath, 'utf8') : '';
+const { sections: diffSections, truncated: diffTruncated, sawDiff } = readAnalyzableSections(diffPath, MAX_ANALYZED_CHARS);
 
-if (!raw || raw.trim().length === 0) {
+if (!sawDiff) {
   console.log('No diff found — exiting.');
   process.exit(0);
 }
 
-function chunkText(text, maxChars = 15000) {
-  const chunks = [];
-  for (let i = 0; i < text.length; i += maxChars) {
-    chunks.push(text.slice(i, i + maxChars));
+// Lazily pack whole per-file diff sections into chunks of at most maxChars, so the model sees each file intact.
+// A section longer than maxChars is spilled line by line into the room left in the current chunk and then into
+// fresh chunks, each continuation repeating the section's "diff --git" line so the model still knows the file.
+function* chunkDiff(sections, maxChars = CHUNK_CHARS) {
+  let parts = [];
+  let size = 0;
+
+  for (const section of sections) {
+    if (section.length <= maxChars) {
+      if (parts.length > 0 && size + section.length > maxChars) {
+        yield parts.join('');
+        parts = [];
+        size = 0;
+      }
+      parts.push(section);
+      size += section.length;
+      continue;
+    }
+
+    const m = section.match(/^diff --git .*\n/m);
+    const header = m && m[0].length < maxChars / 2 ? m[0] : '';
+    let started = false;
+    for (let line of section.split(/(?<=\n)/)) {
+      while (size + line.length > maxChars) {
+        // Lines move whole to the next chunk; only one too long for any chunk is cut, on a surrogate-safe boundary
+        if (parts.length === 0 || header.length + line.length > maxChars) {
+          const cut = clipText(line, maxChars - size).length;
+          if (cut > 0) {
+            parts.push(line.slice(0, cut));
+            started = true;
+            line = line.slice(cut);
+          }
+        }
+        if (parts.length > 0) yield parts.join('');
+        parts = started ? [header] : [];
+        size = started ? header.length : 0;
+      }
+      parts.push(line);
+      size += line.length;
+      started = true;
+    }
   }
-  return chunks;
+  if (parts.length > 0) yield parts.join('');
 }
 
 function buildPrompt(diffChunk) {
@@ -61,46 +176,150 @@ function buildPrompt(diffChunk) {
   ];
 }
 
+// Node's fetch keeps connections alive between calls; retry transient failures on the same pool
+const RETRY_STATUSES = new Set([429, 500, 502, 503, 504]);
+const MAX_RETRIES = 3;
+
+function sleep(ms) {
+  return new Promise(resolve => setTimeout(resolve, ms));
+}
+
 async function callOpenAI(messages) {
-  const res = await fetch('https://api.openai.com/v1/chat/completions', {
-    method: 'POST',
-    headers: {
-      'Content-Type': 'application/json',
-      'Authorization': `Bearer ${OPENAI_KEY}`
-    },
-    body: JSON.stringify({
-      model: 'gpt-4o-mini',
-      messages,
-      max_tokens: 800,
-      temperature: 0.0
-    })
+  const body = JSON.stringify({
+    model: 'gpt-4o-mini',
+    messages,
+    max_tokens: 800,
+    temperature: 0.0,
+    stream: true
   });
 
+  let res;
+  for (let attempt = 0; ; attempt++) {
+    try {
+      res = await fetch('https://api.openai.com/v1/chat/completions', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Authorization': `Bearer ${OPENAI_KEY}`
+        },
+        body
+      });
+    } catch (err) {
+      // Connection-level failures (reset, DNS, socket) get the same backoff as retryable statuses
+      if (attempt >= MAX_RETRIES) throw err;
+      await sleep(500 * 2 ** attempt);
+      continue;
+    }
+    if (res.ok || !RETRY_STATUSES.has(res.status) || attempt >= MAX_RETRIES) break;
+
+    // Drain the error body so the socket goes back to the pool, then back off (honoring Retry-After)
+    await res.text();
+    const retryAfter = Number(res.headers.get('retry-after'));
+    await sleep(retryAfter > 0 ? retryAfter * 1000 : 500 * 2 ** attempt);
+  }
+
   if (!res.ok) {
     const text = await res.text();
     throw new Error(`OpenAI API error ${res.status}: ${text}`);
   }
-  const data = await res.json();
-  const reply = data.choices?.[0]?.message?.content || '';
+
+  // Accumulate streamed deltas; stop reading as soon as the reply holds a complete array of findings
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let pending = '';
+  let reply = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    pending += decoder.decode(value, { stream: true });
+    const lines = pending.split('\n');
+    pending = lines.pop();
+    let closedBracket = false;
+    for (const line of lines) {
+      if (!line.startsWith('data:')) continue;
+      const data = line.slice(5).trim();
+      if (data === '[DONE]') return reply;
+      const delta = JSON.parse(data).choices?.[0]?.delta?.content || '';
+      reply += delta;
+      if (delta.includes(']')) closedBracket = true;
+    }
+    // Only the whole reply counts: a nested array inside a still-open top-level array must not end the stream
+    if (closedBracket && isCompleteFindings(parseWholeReply(stripFences(reply)))) {
+      await reader.cancel();
+      return reply;
+    }
+  }
   return reply;
 }
 
-// Robust JSON extraction: remove markdown fences and find first JSON array/object
-function extractJsonFromText(text) {
-  if (!text || typeof text !== 'string') return null;
+// A non-empty array of objects; bare arrays such as a "[1]" citation in prose do not count
+function isCompleteFindings(parsed) {
+  return Array.isArray(parsed) && parsed.length > 0 && parsed.every(item => item && typeof item === 'object');
+}
 
-  // Remove common markdown fences ```json ... ``` or ``` ... ```
-  let cleaned = text.replace(/```(?:json)?\s*/gi, '');
-  cleaned = cleaned.replace(/```\s*$/gi, '');
+// Diff chunks analyzed at once; kept small so bursts stay under OpenAI rate limits
+const OPENAI_CONCURRENCY = 3;
 
-  // Sometimes model includes triple backticks with language, we removed them above
-  // Try to find the first JSON array or object using a heuristic regex (dotall)
-  const re = /([\[{][\s\S]*[\]}])/m;
-  const m = cleaned.match(re);
-  if (!m) return null;
+// Like Promise.all(items.map(fn)) but with at most `limit` calls in flight; results keep input order
+async function mapWithConcurrency(items, limit, fn) {
+  const results = new Array(items.length);
+  let next = 0;
+  const worker = async () => {
+    while (next < items.length) {
+      const i = next++;
+      results[i] = await fn(items[i], i);
+    }
+  };
+  await Promise.all(Array.from({ length: Math.min(limit, items.length) }, worker));
+  return results;
+}
+
+// Index just past the JSON array/object opening at `start` (brackets inside strings are ignored), or -1 if it never closes
+function findJsonEnd(text, start) {
+  let depth = 0;
+  let inString = false;
+  for (let i = start; i < text.length; i++) {
+    const ch = text[i];
+    if (inString) {
+      if (ch === '\\') i++;
+      else if (ch === '"') inString = false;
+    } else if (ch === '"') {
+      inString = true;
+    } else if (ch === '[' || ch === '{') {
+      depth++;
+    } else if (ch === ']' || ch === '}') {
+      if (--depth === 0) return i + 1;
+    }
+  }
+  return -1;
+}
 
-  const candidate = m[1];
+// Opening and closing fences in one pass: ```json, ```JSON or a bare ```
+const MARKDOWN_FENCE = /```(?:json)?\s*/gi;
 
+function stripFences(text) {
+  return text.replace(MARKDOWN_FENCE, '').trim();
+}
+
+// Fast path: the fence-stripped reply is exactly the JSON we asked for; null otherwise
+function parseWholeReply(cleaned) {
+  if (cleaned[0] !== '[' && cleaned[0] !== '{') return null;
+  try {
+    return JSON.parse(cleaned);
+  } catch (e) {
+    return null;
+  }
+}
+
+// Position of the next '[' or '{' at or after `from`, or -1
+function nextJsonStart(text, from) {
+  const a = text.indexOf('[', from);
+  const b = text.indexOf('{', from);
+  return a === -1 ? b : (b === -1 ? a : Math.min(a, b));
+}
+
+// Parse a JSON candidate, retrying once with small fixes; null if it still fails
+function parseLenient(candidate) {
   // Try safe JSON parse with fallback attempts
   try {
     return JSON.parse(candidate);
@@ -122,74 +341,192 @@ function extractJsonFromText(text) {
   }
 }
 
+// Robust JSON extraction: remove markdown fences and find first JSON array/object
+function extractJsonFromText(text) {
+  if (!text || typeof text !== 'string') return null;
+
+  // Remove common markdown fences ```json ... ``` or ``` ... ```
+  const cleaned = stripFences(text);
+  const whole = parseWholeReply(cleaned);
+  if (whole !== null) return whole;
+
+  // Sometimes model includes triple backticks with language, we removed them above
+  // Like JSONDecoder.raw_decode: try each top-level '[' or '{' in turn and stop where it closes, so prose
+  // before or after the JSON is ignored. A value that closes but does not parse is skipped whole, and one
+  // that never closes ends the search, so a value nested inside another is never returned on its own.
+  for (let start = nextJsonStart(cleaned, 0); start !== -1;) {
+    const end = findJsonEnd(cleaned, start);
+    if (end === -1) return null;
+    const parsed = parseLenient(cleaned.slice(start, end));
+    if (parsed !== null) return parsed;
+    start = nextJsonStart(cleaned, end);
+  }
+  return null;
+}
+
+// GitHub rejects issue bodies longer than 65536 characters; keep some headroom for the omission notes
+const MAX_ISSUE_BODY_CHARS = 65000;
+
+// Cut text to at most `limit` UTF-16 code units without splitting a surrogate pair
+function clipText(text, limit) {
+  if (text.length <= limit) return text;
+  let end = limit;
+  const code = text.charCodeAt(end - 1);
+  if (code >= 0xd800 && code <= 0xdbff) end -= 1;
+  return text.slice(0, end);
+}
+
+// Severities the prompt asks for, plus unambiguous synonyms the model sometimes uses instead
+const SEVERITIES = new Map([
+  ['LOW', 'LOW'], ['MEDIUM', 'MEDIUM'], ['HIGH', 'HIGH'], ['CRITICAL', 'CRITICAL'],
+  ['INFO', 'LOW'], ['INFORMATIONAL', 'LOW'], ['MODERATE', 'MEDIUM'], ['MED', 'MEDIUM']
+]);
+
+// Missing severity defaults to LOW; any other unrecognized value is kept as given so it is never silently downgraded
+function normalizeSeverity(value) {
+  if (value === undefined || value === null || value === '') return 'LOW';
+  const s = sanitizeLine(value, 40).toUpperCase();
+  return SEVERITIES.get(s) || s || 'LOW';
+}
+
+// Collapse whitespace runs (including newlines) so a value stays on one markdown line
+const WHITESPACE_RUN = /\s+/g;
+
+function sanitizeLine(value, maxLen = 200) {
+  const s = String(value).replace(WHITESPACE_RUN, ' ').trim();
+  return s.length <= maxLen ? s : clipText(s, maxLen - 3) + '...';
+}
+
+function rawReplyNote(n, kept) {
+  return kept
+    ? `OpenAI reply could not be parsed as JSON. See raw reply ${n} below.`
+    : `OpenAI reply could not be parsed as JSON. Raw reply ${n} was omitted to fit the GitHub issue size limit.`;
+}
+
+const ISSUE_INTRO = 'Automated vulnerability analysis results (OpenAI).\n';
+
+function formatFinding(f, idx) {
+  return `#### ${idx + 1}. ${f.issue}
+- **File / Range:** ${f.file} / ${f.line_range}
+- **Severity:** ${f.severity}
+- **Confidence:** ${f.confidence}
+- **Remediation:**\n\n\`\`\`\n${f.remediation}\n\`\`\`
+`;
+}
+
 (async () => {
   try {
-    const chunks = chunkText(raw, 15000);
+    // A truncated diff still gets an issue carrying the coverage note, so unanalyzed changes are never silent
+    if (diffSections.length === 0 && !diffTruncated) {
+      console.log('Only binary or vendored changes in diff — exiting.');
+      return;
+    }
+    const chunks = [];
+    let chunksCapped = false;
+    // Chunking is lazy, so it stops here instead of packing the whole diff
+    for (const chunk of chunkDiff(diffSections)) {
+      if (chunks.length === MAX_CHUNKS) {
+        chunksCapped = true;
+        break;
+      }
+      chunks.push(chunk);
+    }
     const allFindings = [];
-    const rawReplies = [];
+    const problematicReplies = [];
+    const seen = new Set();
 
-    for (let i = 0; i < chunks.length; i++) {
-      const messages = buildPrompt(chunks[i]);
-      const reply = await callOpenAI(messages);
-      rawReplies.push(reply);
+    const replies = await mapWithConcurrency(chunks, OPENAI_CONCURRENCY, chunk => callOpenAI(buildPrompt(chunk)));
 
+    for (const reply of replies) {
       const parsed = extractJsonFromText(reply);
       if (parsed && Array.isArray(parsed)) {
-        // Ensure each item has required fields, normalize a bit
+        // Ensure each item has required fields, normalize a bit, and drop duplicates in the same pass
         for (const item of parsed) {
+          if (!item || typeof item !== 'object') continue;
+          const { confidence } = item;
           const normalized = {
-            file: item.file || item.filename || 'unknown',
-            line_range: item.line_range || item.line || 'n/a',
-            issue: item.issue || item.title || 'unspecified issue',
-            severity: (item.severity || 'LOW').toUpperCase(),
-            confidence: typeof item.confidence === 'number' ? item.confidence : (parseFloat(item.confidence) || 0.5),
+            file: sanitizeLine(item.file || item.filename || 'unknown'),
+            line_range: sanitizeLine(item.line_range || item.line || 'n/a'),
+            issue: sanitizeLine(item.issue || item.title || 'unspecified issue'),
+            severity: normalizeSeverity(item.severity),
+            confidence: typeof confidence === 'number' ? confidence : (parseFloat(confidence) || 0.5),
             remediation: item.remediation || item.fix || 'No remediation provided.'
           };
+          const key = `${normalized.file}\0${normalized.line_range}\0${normalized.issue}`;
+          if (seen.has(key)) continue;
+          seen.add(key);
           allFindings.push(normalized);
         }
       } else {
-        // If parsing failed, include fallback finding with raw reply for visibility
+        // If parsing failed, include fallback finding pointing at the raw reply kept for the debug section;
+        // its remediation text is filled in once the body knows whether that reply fit
+        problematicReplies.push(reply);
         allFindings.push({
           file: 'multiple',
           line_range: 'n/a',
-          issue: 'Analysis parse error — raw output included',
+          issue: 'Analysis parse error — OpenAI reply was not valid JSON',
           severity: 'LOW',
           confidence: 0.5,
-          remediation: `OpenAI reply could not be parsed as JSON. Raw reply:\n\n${reply}`
+          rawReply: problematicReplies.length
         });
       }
     }
 
-    // Build issue body
-    const bodyLines = [];
-    bodyLines.push('Automated vulnerability analysis results (OpenAI).');
-    bodyLines.push('');
-    bodyLines.push('### Findings');
+    // Build issue body, stopping once the next block would overflow the GitHub size limit
+    const bodyLines = [ISSUE_INTRO];
+    let budget = MAX_ISSUE_BODY_CHARS - ISSUE_INTRO.length;
+    const pushWithin = (block) => {
+      if (block.length + 1 > budget) return false;
+      bodyLines.push(block);
+      budget -= block.length + 1;
+      return true;
+    };
 
-    allFindings.forEach((f, idx) => {
-      bodyLines.push(`#### ${idx + 1}. ${f.issue}`);
-      bodyLines.push(`- **File / Range:** ${f.file} / ${f.line_range}`);
-      bodyLines.push(`- **Severity:** ${f.severity}`);
-      bodyLines.push(`- **Confidence:** ${f.confidence}`);
-      bodyLines.push(`- **Remediation:**\n\n\`\`\`\n${f.remediation}\n\`\`\``);
-      bodyLines.push('');
-    });
+    // One coverage note, above the findings: the chunk cap, when hit, is the tighter limit on what was analyzed
+    if (chunksCapped) {
+      pushWithin(`_Diff needed more than ${MAX_CHUNKS} analysis requests; only the first ${MAX_CHUNKS} were sent and later changes were not analyzed._\n`);
+    } else if (diffTruncated) {
+      pushWithin(`_Diff has more than ${MAX_ANALYZED_CHARS} characters of analyzable changes; later files were not analyzed._\n`);
+    }
+    pushWithin('### Findings');
+
+    // Fallback findings are sized with the longer "omitted" wording, then switched to "see below" once their
+    // raw reply is known to fit, which can only shrink the body
+    const fallbackLines = [];
+    for (let idx = 0; idx < allFindings.length; idx++) {
+      const f = allFindings[idx];
+      const block = f.rawReply ? formatFinding({ ...f, remediation: rawReplyNote(f.rawReply, false) }, idx) : formatFinding(f, idx);
+      if (!pushWithin(block)) {
+        bodyLines.push(`_${allFindings.length - idx} more findings omitted to fit GitHub issue size limit._`);
+        break;
+      }
+      if (f.rawReply) fallbackLines.push({ line: bodyLines.length - 1, f, idx });
+    }
 
     // If there were any raw replies that contained extra info, append as folded details for debugging
-    const problematicReplies = rawReplies.filter(r => !extractJsonFromText(r));
-    if (problematicReplies.length > 0) {
-      bodyLines.push('---');
-      bodyLines.push('### Raw responses that could not be parsed as strict JSON (for debugging)');
-      problematicReplies.forEach((r, i) => {
+    let rawRepliesKept = 0;
+    if (problematicReplies.length > 0 &&
+        pushWithin('---\n### Raw responses that could not be parsed as strict JSON (for debugging)')) {
+      for (; rawRepliesKept < problematicReplies.length; rawRepliesKept++) {
         // Fold long blocks
-        bodyLines.push(`<details><summary>Raw reply ${i + 1}</summary>\n\n\n\`\`\`\n${r}\n\`\`\`\n</details>`);
-      });
+        const r = problematicReplies[rawRepliesKept];
+        if (!pushWithin(`<details><summary>Raw reply ${rawRepliesKept + 1}</summary>\n\n\n\`\`\`\n${r}\n\`\`\`\n</details>`)) {
+          bodyLines.push(`_${problematicReplies.length - rawRepliesKept} more raw replies omitted to fit GitHub issue size limit._`);
+          break;
+        }
+      }
+    }
+    for (const { line, f, idx } of fallbackLines) {
+      if (f.rawReply <= rawRepliesKept) {
+        bodyLines[line] = formatFinding({ ...f, remediation: rawReplyNote(f.rawReply, true) }, idx);
+      }
     }
 
     const issueTitle = `[AutoSecurity] ${allFindings.length} findings for ${PR_NUMBER ? 'PR #' + PR_NUMBER : 'recent push'}`;
     const issueBody = bodyLines.join('\n');
 
-    // Create GitHub issue
+    // Create GitHub issue; Octokit is loaded only here so the no-diff and failure paths skip its import cost
+    const { Octokit } = await import('@octokit/rest');
     const octokit = new Octokit({ auth: GITHUB_TOKEN });
     const [owner, repo] = REPO.split('/');
 